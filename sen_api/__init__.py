@@ -5,5 +5,8 @@ __author__ = 'Marco Volpato'
 from .exceptions import *
 from .config import *
 from .models import *
+from .forms import *
 from .provider import *
+from .prefetch import *
+from .profiling import *
 from .cli import *
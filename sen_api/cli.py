@@ -1,4 +1,6 @@
+import os
 import math
+from datetime import timedelta
 from functools import wraps
 from json import dumps as json_dumps
 
@@ -9,7 +11,8 @@ from rich.console import Console
 from rich.table import Table
 from loguru import logger
 
-from sen_api import SENProvider, Config, __version__, AuthenticationError
+from sen_api import SENProvider, Config, __version__, AuthenticationError, IntervalReading, Bill, \
+    PrefetchStore, PrefetchScheduler, DEFAULT_MAX_AGE, Profiler, PROFILE_MODES, PROFILES_DIR_NAME
 
 
 __all__ = [
@@ -19,6 +22,7 @@ __all__ = [
 
 config = Config()
 provider = SENProvider(config=config)
+store = PrefetchStore(base_path=config.base_path)
 
 console = Console()
 
@@ -36,21 +40,70 @@ def auth_required(f):
         return f(*args, **kwargs)
     return wrapper
 
+
+@auth_required
+def _fetch(getter, *args, **kwargs):
+    return getter(*args, **kwargs)
+
+
+def _max_age() -> int:
+    return int(config.get_value('prefetch', 'max_age', fallback=DEFAULT_MAX_AGE))
+
+
+def _from_store(ctx, dataset):
+    """
+    :return: prefetched data if fresh enough, None otherwise
+    """
+    if ctx.obj['NO_CACHE'] or not provider.username:
+        return None
+    data = store.get(provider.username, dataset, max_age=_max_age())
+    if data is not None:
+        logger.debug(f'Using prefetched {dataset}')
+    return data
+
+
+class ProfileGroup(click.Group):
+    def parse_args(self, ctx, args):
+        # a bare "--profile" defaults to cpu, instead of taking the command name as its value
+        args = list(args)
+        for i, arg in enumerate(args):
+            if arg == '--profile' and (i + 1 == len(args) or args[i + 1] not in PROFILE_MODES):
+                args[i] = '--profile=cpu'
+            elif not arg.startswith('-') and (i == 0 or args[i - 1] != '--profile'):
+                # command name reached, its own arguments are left untouched
+                break
+        return super().parse_args(ctx, args)
+
 ########################################################################################################################
 
 
-@click.group()
+@click.group(cls=ProfileGroup)
 @click.version_option(__version__)
 @click.option('--verbose', '-v', help='Enable verbose logs.', is_flag=True)
 @click.option('--json', '-j', help='Print in JSON format when possible.', is_flag=True)
+@click.option('--no-cache', help='Always fetch data from the portal, ignoring prefetched data.', is_flag=True)
+@click.option('--profile', type=click.Choice(PROFILE_MODES), is_flag=False, flag_value='cpu',
+              help='Profile the command CPU time (default) or memory allocations.')
 @click.pass_context
-def cli(ctx, verbose, json):
+def cli(ctx, verbose, json, no_cache, profile):
     ctx.ensure_object(dict)
     if not verbose:
         logger.remove()
     ctx.obj['JSON'] = json
+    ctx.obj['NO_CACHE'] = no_cache
     config.load()
 
+    if profile:
+        profiler = Profiler(
+            mode=profile,
+            output_dir=os.path.join(config.base_path, PROFILES_DIR_NAME),
+            name=ctx.invoked_subcommand or 'cli'
+        )
+        # registered first, so it runs after the profiler has written its files
+        ctx.call_on_close(lambda: echo(f'Profile written to {profiler.report_path} and {profiler.collapsed_path}',
+                                       err=True))
+        ctx.with_resource(profiler)
+
 ########################################################################################################################
 
 
@@ -97,9 +150,12 @@ def authenticate(username, password):
 ########################################################################################################################
 
 
-@auth_required
-def last_reading(json):
-    reading = provider.get_last_reading()
+def last_reading(ctx, json):
+    reading = _from_store(ctx, 'last_reading')
+    if reading is None:
+        reading = _fetch(provider.get_last_reading)
+        if reading is None:
+            return
 
     if json:
         echo(json_dumps(reading))
@@ -117,9 +173,14 @@ def last_reading(json):
         console.print(table)
 
 
-@auth_required
-def all_readings(json):
-    readings_list = provider.get_all_readings()
+def all_readings(ctx, json):
+    cached = _from_store(ctx, 'all_readings')
+    if cached is not None:
+        readings_list = [IntervalReading.from_dict(r) for r in cached]
+    else:
+        readings_list = _fetch(provider.get_all_readings)
+        if readings_list is None:
+            return
 
     if json:
         echo(json_dumps([r.to_dict() for r in readings_list]))
@@ -155,9 +216,9 @@ def all_readings(json):
 def readings(ctx, _all, last):
     json = ctx.obj['JSON']
     if _all:
-        all_readings(json)
+        all_readings(ctx, json)
     elif last:
-        last_reading(json)
+        last_reading(ctx, json)
     else:
         echo(ctx.get_help())
         ctx.exit()
@@ -189,11 +250,14 @@ def client_info(ctx):
 @click.option('--year', '-y', help='Specify the bills year.')
 @click.option('--download', '-d', type=int, help='Download bill with the specified in PDF format.')
 @click.pass_context
-@auth_required
 def bills(ctx, year, download):
     json = ctx.obj['JSON']
     if not year:
-        years = provider.get_bills_available_years()
+        years = _from_store(ctx, 'bills_years')
+        if years is None:
+            years = _fetch(provider.get_bills_available_years)
+            if years is None:
+                return
         if json:
             echo(json_dumps({'available_years': years}))
         else:
@@ -204,11 +268,18 @@ def bills(ctx, year, download):
 
             console.print(table)
     else:
-        try:
-            bills_list = provider.get_bills(year=year)
-        except ValueError as e:
-            echo(e)
-            ctx.exit()
+        # prefetched bills have no download params, which depend on the session
+        cached = None if download else _from_store(ctx, f'bills_{year}')
+        if cached is not None:
+            bills_list = [Bill.from_dict(b) for b in cached]
+        else:
+            try:
+                bills_list = _fetch(provider.get_bills, year=year)
+            except ValueError as e:
+                echo(e)
+                ctx.exit()
+            if bills_list is None:
+                return
 
         if download:
             found_bill = None
@@ -253,3 +324,48 @@ def bills(ctx, year, download):
 
                 console.print(table)
                 console.print('Values above the average are colored [red]red[/red].\n')
+
+########################################################################################################################
+
+
+@cli.command()
+@click.option('--interval', '-i', type=click.IntRange(min=1), help='Seconds between two refreshes of the same account.')
+@click.option('--once', help='Refresh all the data once and exit.', is_flag=True)
+@click.option('--status', '-s', help='Show the freshness of the prefetched data and exit.', is_flag=True)
+@click.pass_context
+def prefetch(ctx, interval, once, status):
+    if status:
+        freshness = store.freshness(provider.username)
+        if ctx.obj['JSON']:
+            echo(json_dumps({dataset: int(age) for dataset, age in freshness.items()}))
+        else:
+            max_age = _max_age()
+            table = Table(title='Prefetched data')
+            table.add_column('Dataset')
+            table.add_column('Age', justify='center')
+            table.add_column('Fresh', justify='center')
+            for dataset, age in freshness.items():
+                table.add_row(
+                    dataset,
+                    str(timedelta(seconds=int(age))),
+                    '[green]Yes[/green]' if age <= max_age else '[red]No[/red]'
+                )
+
+            console.print(table)
+        return
+
+    try:
+        scheduler = PrefetchScheduler.from_config(config, [provider], store, interval=interval)
+    except ValueError as e:
+        echo(f'Invalid prefetch configuration: {e}')
+        ctx.exit()
+    if once:
+        with Halo(text='Prefetching', spinner='dots'):
+            scheduler.run_once()
+        echo('Data prefetched.')
+    else:
+        echo(f'Prefetching every {scheduler.interval} seconds, press Ctrl+C to stop.')
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+from typing import Optional
+
+from bs4 import Tag
+from loguru import logger
+
+from sen_api import CONFIG_BASE_PATH
+
+
+__all__ = [
+    'FormTemplate',
+    'FormTemplateCache',
+    'FORMS_FILE_NAME',
+    'DEFAULT_FORMS_MAX_AGE'
+]
+
+
+FORMS_FILE_NAME = 'forms.json'
+DEFAULT_FORMS_MAX_AGE = 7 * 24 * 60 * 60
+
+# inputs filled by the user, never part of a template
+_USER_INPUT_TYPES = ('text', 'password', 'email')
+
+
+class FormTemplate(object):
+    """
+    Action URL and static inputs of a form, used to submit it again without fetching the page containing it
+    """
+    def __init__(self, action: str, fields: dict):
+        self.action = action
+        self.fields = fields
+
+    @classmethod
+    def from_form(cls, form: Tag, keep_values=True) -> 'FormTemplate':
+        """
+        :param keep_values: if False only the input names are kept, for forms carrying secrets
+        """
+        fields = dict()
+        for field in form.find_all('input'):
+            name = field.get('name')
+            if name is None or field.get('type', 'text').lower() in _USER_INPUT_TYPES:
+                continue
+            fields[name] = field.get('value', None) if keep_values else None
+        return cls(action=form.get('action'), fields=fields)
+
+    def matches(self, form: Tag) -> bool:
+        """
+        :return: True if the form has the same action and inputs, values aside
+        """
+        other = FormTemplate.from_form(form)
+        return other.action == self.action and set(other.fields.keys()) == set(self.fields.keys())
+
+    def to_dict(self) -> dict:
+        return {
+            'action': self.action,
+            'fields': self.fields
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'FormTemplate':
+        return cls(action=values['action'], fields=values['fields'])
+
+    def __str__(self):
+        return f'<FormTemplate action={self.action},fields={",".join(self.fields.keys())}>'
+
+    def __repr__(self):
+        return self.__str__()
+
+########################################################################################################################
+
+
+class FormTemplateCache(object):
+    def __init__(self, base_path=CONFIG_BASE_PATH, file_name=FORMS_FILE_NAME, max_age=DEFAULT_FORMS_MAX_AGE):
+        self.path = os.path.join(base_path, file_name)
+        self.max_age = max_age
+
+    def _read(self) -> dict:
+        if not os.path.isfile(self.path):
+            return dict()
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning('Form templates cache is corrupted, ignoring it')
+            return dict()
+
+    def _write(self, values: dict):
+        # write and rename, so concurrent logins (e.g. CLI and prefetch) never read a partially written file
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(values, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, name: str) -> Optional[FormTemplate]:
+        """
+        :return: the template, None if missing or expired
+        """
+        entry = self._read().get(name)
+        if not isinstance(entry, dict) or 'saved_at' not in entry or 'template' not in entry:
+            return None
+        if time.time() - entry['saved_at'] > self.max_age:
+            return None
+        return FormTemplate.from_dict(entry['template'])
+
+    def put(self, name: str, template: FormTemplate):
+        values = self._read()
+        values[name] = {
+            'saved_at': time.time(),
+            'template': template.to_dict()
+        }
+        self._write(values)
+
+    def invalidate(self):
+        logger.debug('Invalidating form templates...')
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -1,6 +1,6 @@
 import math
 
-from .utils import str_to_datetime
+from .utils import str_to_datetime, iso_to_str
 
 __all__ = [
     'IntervalReading',
@@ -25,6 +25,14 @@ class IntervalReading(object):
             'avg_consumption': self.avg_consumption
         }
 
+    @classmethod
+    def from_dict(cls, values: dict) -> 'IntervalReading':
+        return cls(
+            interval_start=iso_to_str(values['interval_start']),
+            interval_end=iso_to_str(values['interval_end']),
+            total_consumption=values['total_consumption']
+        )
+
     def __eq__(self, other: 'IntervalReading'):
         return (
             self.interval_start == other.interval_start,
@@ -66,6 +74,17 @@ class Bill(object):
             'includes_rai_tax': self.includes_rai_tax
         }
 
+    @classmethod
+    def from_dict(cls, values: dict) -> 'Bill':
+        return cls(
+            number=values['number'],
+            due_date=iso_to_str(values['due_date']),
+            amount=values['amount'],
+            is_payed=values['is_payed'],
+            includes_rai_tax=values['includes_rai_tax'],
+            params=dict()
+        )
+
     def __str__(self):
         return f'<Bill ' \
                f'number={str(self.number)},' \
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import random
+import threading
+from datetime import datetime
+from typing import Optional, List, Callable
+
+from loguru import logger
+from requests import RequestException
+
+from sen_api import Config, SENProvider, AuthenticationError, CONFIG_BASE_PATH
+
+
+__all__ = [
+    'PrefetchStore',
+    'PrefetchScheduler',
+    'PREFETCH_STORE_FILE_NAME',
+    'DEFAULT_PREFETCH_INTERVAL',
+    'DEFAULT_SESSION_TTL',
+    'DEFAULT_MAX_AGE'
+]
+
+
+PREFETCH_STORE_FILE_NAME = 'prefetch.json'
+DEFAULT_PREFETCH_INTERVAL = 15 * 60
+DEFAULT_SESSION_TTL = 20 * 60
+DEFAULT_MAX_AGE = 60 * 60
+
+# refresh the session when 80% of its lifetime has passed
+SESSION_REFRESH_MARGIN = 0.2
+
+
+class PrefetchStore(object):
+    """
+    JSON file holding the last prefetched data of every account, with the time it was fetched
+    """
+    def __init__(self, base_path=CONFIG_BASE_PATH, file_name=PREFETCH_STORE_FILE_NAME):
+        self.path = os.path.join(base_path, file_name)
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        if not os.path.isfile(self.path):
+            return dict()
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning('Prefetch store is corrupted, ignoring it')
+            return dict()
+
+    def put(self, account: str, dataset: str, data):
+        with self._lock:
+            values = self._read()
+            values.setdefault(account, dict())[dataset] = {
+                'fetched_at': time.time(),
+                'data': data
+            }
+            # write and rename, so readers never see a partially written file
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(values, f)
+            os.replace(tmp_path, self.path)
+
+    def get(self, account: str, dataset: str, max_age: Optional[float] = None) -> Optional:
+        """
+        :return: the stored data, None if missing or older than max_age seconds
+        """
+        entry = self._read().get(account, dict()).get(dataset)
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry['fetched_at'] > max_age:
+            return None
+        return entry['data']
+
+    def freshness(self, account: str) -> dict:
+        """
+        :return: age in seconds of every dataset stored for the account
+        """
+        now = time.time()
+        return {dataset: now - entry['fetched_at'] for dataset, entry in self._read().get(account, dict()).items()}
+
+########################################################################################################################
+
+
+class PrefetchScheduler(object):
+    """
+    Keeps sessions and data of the given accounts warm, refreshing them on a jittered schedule.
+
+    Accounts are staggered over the interval and two portal requests are always at least min_spacing seconds apart.
+    When running in-process with start(), give the scheduler its own providers: sessions are not thread safe.
+    """
+    def __init__(self, providers: List[SENProvider], store: PrefetchStore, interval=DEFAULT_PREFETCH_INTERVAL,
+                 session_ttl=DEFAULT_SESSION_TTL, jitter=0.1, min_spacing=2.0):
+        if interval <= 0 or session_ttl <= 0:
+            raise ValueError('Prefetch interval and session TTL must be greater than 0.')
+        if not 0 <= jitter < 1 or min_spacing < 0:
+            raise ValueError('Prefetch jitter must be between 0 and 1 and minimum spacing cannot be negative.')
+        self._providers = providers
+        self._store = store
+        self.interval = interval
+        self.session_ttl = session_ttl
+        self.jitter = jitter
+        self.min_spacing = min_spacing
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_request = 0.0
+
+        now = time.time()
+        step = interval / len(providers) if providers else 0
+        self._next_prefetch = [now + i * step for i in range(len(providers))]
+        self._next_session_refresh = [self._session_due(p) for p in providers]
+
+    @classmethod
+    def from_config(cls, config: Config, providers: List[SENProvider], store: PrefetchStore,
+                    interval: Optional[int] = None) -> 'PrefetchScheduler':
+        if interval is None:
+            interval = int(config.get_value('prefetch', 'interval', fallback=DEFAULT_PREFETCH_INTERVAL))
+        session_ttl = int(config.get_value('prefetch', 'session_ttl', fallback=DEFAULT_SESSION_TTL))
+        return cls(providers, store, interval=interval, session_ttl=session_ttl)
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _session_due(self, provider: SENProvider) -> float:
+        age = provider.session_age
+        if age is None:
+            return time.time()
+        return time.time() - age + self.session_ttl * (1 - SESSION_REFRESH_MARGIN)
+
+    def _pace(self):
+        wait = self._last_request + self.min_spacing - time.time()
+        if wait > 0:
+            self._stop_event.wait(wait)
+        self._last_request = time.time()
+
+    def _schedule_session_refresh(self, index: int):
+        now = time.time()
+        self._next_session_refresh[index] = now + self._jittered(self._session_due(self._providers[index]) - now)
+
+    def _refresh_session(self, index: int, force=False) -> bool:
+        """
+        Keeps the session alive, logging in again only when the portal dropped it
+        (or always if force is True, e.g. when a page could not be parsed)
+        :return: True if the account has a usable session
+        """
+        provider = self._providers[index]
+        due = self._session_due(provider)
+        if not force and due > time.time():
+            # someone else (e.g. the CLI) refreshed it in the meantime
+            self._next_session_refresh[index] = due
+            return provider.load_session()
+
+        if not force:
+            logger.debug(f'Checking session of {provider.username}...')
+            self._pace()
+            try:
+                is_authenticated = provider.is_authenticated
+            except RequestException as e:
+                logger.error(f'Cannot check session of {provider.username}: {e}')
+                is_authenticated = False
+            if is_authenticated:
+                # saving it resets its age, the check request already kept it alive on the portal
+                provider.save_session()
+                self._schedule_session_refresh(index)
+                return True
+
+        logger.debug(f'Logging in {provider.username} again...')
+        self._pace()
+        try:
+            provider.authenticate(force=True)
+        except (AuthenticationError, ValueError, RequestException) as e:
+            logger.error(f'Cannot refresh session of {provider.username}: {e}')
+            self._next_session_refresh[index] = time.time() + self._jittered(self.interval)
+            return False
+        self._schedule_session_refresh(index)
+        return True
+
+    def _fetch(self, index: int, dataset: str, getter: Callable):
+        provider = self._providers[index]
+        for attempt in range(2):
+            self._pace()
+            try:
+                data = getter()
+            except (AttributeError, IndexError, TypeError):
+                # the page could not be parsed, most likely the session expired on the portal side
+                logger.debug(f'Cannot parse {dataset} of {provider.username}')
+                if attempt == 0 and self._refresh_session(index, force=True):
+                    continue
+                logger.error(f'Cannot prefetch {dataset} of {provider.username}')
+                return None
+            except (ValueError, RequestException) as e:
+                logger.error(f'Cannot prefetch {dataset} of {provider.username}: {e}')
+                return None
+            self._store.put(provider.username, dataset, data)
+            return data
+        return None
+
+    def prefetch(self, index: int):
+        provider = self._providers[index]
+        self._next_prefetch[index] = time.time() + self._jittered(self.interval)
+        try:
+            self._prefetch(index)
+        except Exception:
+            # keep the other accounts, and this one at the next round, going
+            logger.exception(f'Unexpected error while prefetching data of {provider.username}')
+
+    def _prefetch(self, index: int):
+        provider = self._providers[index]
+        if not self._refresh_session(index):
+            return
+
+        logger.debug(f'Prefetching data of {provider.username}...')
+        self._fetch(index, 'last_reading', provider.get_last_reading)
+        self._fetch(index, 'all_readings', lambda: [r.to_dict() for r in provider.get_all_readings()])
+        years = self._fetch(index, 'bills_years', provider.get_bills_available_years)
+        year = str(datetime.now().year)
+        if years and year in years:
+            self._fetch(index, f'bills_{year}', lambda: [b.to_dict() for b in provider.get_bills(year)])
+
+        freshness = ', '.join(f'{d}={int(age)}s' for d, age in self._store.freshness(provider.username).items())
+        logger.info(f'Data freshness of {provider.username}: {freshness}')
+
+    def run_once(self):
+        for index in range(len(self._providers)):
+            self.prefetch(index)
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            events = [(when, i, False) for i, when in enumerate(self._next_prefetch)]
+            events += [(when, i, True) for i, when in enumerate(self._next_session_refresh)]
+            if not events:
+                return
+            when, index, is_session_refresh = min(events)
+            if self._stop_event.wait(max(0.0, when - time.time())):
+                break
+            if is_session_refresh:
+                try:
+                    self._refresh_session(index)
+                except Exception:
+                    logger.exception(f'Unexpected error while refreshing session of {self._providers[index].username}')
+                    self._next_session_refresh[index] = time.time() + self._jittered(self.interval)
+            else:
+                self.prefetch(index)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='sen-api-prefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+
+from sen_api import CONFIG_BASE_PATH
+
+
+__all__ = [
+    'Profiler',
+    'PROFILE_MODES',
+    'PROFILES_DIR_NAME'
+]
+
+
+PROFILE_MODES = ('cpu', 'mem')
+PROFILES_DIR_NAME = 'profiles'
+
+# modules where the time is spent waiting for the portal rather than computing
+_NETWORK_MODULES = ('socket.py', 'ssl.py', 'selectors.py')
+_NETWORK_BUILTINS = ('_socket', '_ssl')
+
+
+def _frame_label(filename: str, name: str) -> str:
+    return f'{os.path.basename(filename)}:{name}'
+
+
+class _StackSampler(threading.Thread):
+    """
+    Samples the stacks of all the other threads (e.g. Halo spinners too), counting how many times each stack is seen.
+    Stacks start with the name of their thread
+    """
+    def __init__(self, interval: float):
+        super().__init__(name='sen-api-profiler', daemon=True)
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.stacks = Counter()
+        self.network_samples = 0
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                if os.path.basename(frame.f_code.co_filename) in _NETWORK_MODULES:
+                    self.network_samples += 1
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code.co_filename, frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(';', '_'))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler(object):
+    """
+    Context manager profiling the enclosed code, either with cProfile (cpu) or tracemalloc (mem).
+
+    On exit it writes a sorted text report and a collapsed-stack file readable by flamegraph tools,
+    e.g. ``with Profiler('cpu'): provider.get_bills('2019')``.
+    """
+    def __init__(self, mode='cpu', output_dir: Optional[str] = None, name='profile', limit=50, interval=0.005):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Profile mode must be one of {", ".join(PROFILE_MODES)}')
+        self.mode = mode
+        self.output_dir = output_dir if output_dir else os.path.join(CONFIG_BASE_PATH, PROFILES_DIR_NAME)
+        self.name = name
+        self.limit = limit
+        self.interval = interval
+        self.report_path = None
+        self.collapsed_path = None
+        self._profile = None
+        self._sampler = None
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+
+    def __enter__(self) -> 'Profiler':
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if self.mode == 'cpu':
+            self._sampler = _StackSampler(self.interval)
+            self._sampler.start()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            tracemalloc.start(25)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.mode == 'cpu':
+            self._profile.disable()
+            self._sampler.stop()
+        wall_time = time.perf_counter() - self._wall_start
+        cpu_time = time.process_time() - self._cpu_start
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        # microseconds and pid, so runs in the same second don't overwrite each other
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        base_path = os.path.join(self.output_dir, f'{self.name}-{self.mode}-{timestamp}-{os.getpid()}')
+        self.report_path = f'{base_path}.txt'
+        self.collapsed_path = f'{base_path}.collapsed'
+
+        header = f'wall time: {wall_time:.3f}s\ncpu time: {cpu_time:.3f}s\n'
+        if self.mode == 'cpu':
+            self._write_cpu(base_path, header)
+        else:
+            self._write_mem(header)
+        logger.debug(f'Profile report written to {self.report_path}')
+        return False
+
+    def _write_cpu(self, base_path: str, header: str):
+        self._profile.dump_stats(f'{base_path}.pstats')
+        stats = pstats.Stats(self._profile)
+        # builtins are keyed as ('~', 0, "<method 'recv_into' of '_socket.socket' objects>")
+        network_time = sum(
+            tottime for (_, _, name), (_, _, tottime, _, _) in stats.stats.items()
+            if any(module in name for module in _NETWORK_BUILTINS)
+        )
+        total_samples = sum(self._sampler.stacks.values())
+
+        with open(self.report_path, 'w') as f:
+            f.write(header)
+            f.write(f'network wait: {network_time:.3f}s (time spent in socket and ssl calls)\n')
+            f.write(f'samples: {total_samples} ({self._sampler.network_samples} waiting on the network)\n\n')
+            pstats.Stats(self._profile, stream=f).sort_stats('cumulative').print_stats(self.limit)
+
+        with open(self.collapsed_path, 'w') as f:
+            for stack, count in self._sampler.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def _write_mem(self, header: str):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+
+        with open(self.report_path, 'w') as f:
+            f.write(header)
+            f.write(f'allocated memory: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)\n\n')
+            for stat in snapshot.statistics('lineno')[:self.limit]:
+                f.write(f'{stat}\n')
+
+        # frames go from the oldest to the most recent, weighted by allocated bytes
+        with open(self.collapsed_path, 'w') as f:
+            for stat in snapshot.statistics('traceback'):
+                stack = ';'.join(_frame_label(frame.filename, str(frame.lineno)) for frame in stat.traceback)
+                f.write(f'{stack} {stat.size}\n')
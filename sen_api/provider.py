@@ -1,12 +1,14 @@
 import os
 import pickle
+import time
 import requests
 from typing import Optional, List
+from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 from loguru import logger
 
-from sen_api import IntervalReading, Config, Bill, AuthenticationError
+from sen_api import IntervalReading, Config, Bill, AuthenticationError, FormTemplate, FormTemplateCache
 
 
 __all__ = [
@@ -22,10 +24,14 @@ class SENProvider(object):
     _bill_download_url = f'{_base_url}/clienti/SEN/servizi/Areaclienti/DettaglioBolletta/vediPDF.ser?from=bollettaPDF'
     _meter_readings_url = f'{_base_url}/clienti/SEN/servizi/Areaclienti/LeggiConsumi/a.ser?funz=A09&destMenu=areaclienti_left.jsp&from=modifica'
 
+    # login form, saml request and saml response, plus checking the client area page
+    _max_login_hops = 4
+
     def __init__(self, config: Config):
         self._session = requests.Session()
         self._session_path = os.path.join(config.base_path, 'session.pickle')
         self._config = config
+        self._forms = FormTemplateCache(base_path=config.base_path)
         self._client_id = None
         self._client_name = None
 
@@ -33,12 +39,31 @@ class SENProvider(object):
     def _get_soup(data) -> BeautifulSoup:
         return BeautifulSoup(data, 'html.parser')
 
-    def _send_form(self, form=None, soup_data: Optional[str] = None, form_data: Optional[dict] = None):
-        if not form:
-            soup = self._get_soup(soup_data)
-            if not form_data:
-                form_data = dict()
-            form = soup.find('form')
+    @staticmethod
+    def _get_form(data) -> Optional[Tag]:
+        # parse only the forms, login pages are big and nothing else is needed from them
+        return BeautifulSoup(data, 'html.parser', parse_only=SoupStrainer('form')).find('form')
+
+    @staticmethod
+    def _is_login_form(form: Tag) -> bool:
+        return form.find('input', attrs={'name': 'txtUsername'}) is not None
+
+    def _get_login_step_form(self, data, step: str) -> Tag:
+        form = self._get_form(data)
+        if form is None:
+            # maintenance or error page, or the login flow changed
+            message = f'Unexpected page during login, no {step} form found.'
+            logger.error(message)
+            raise AuthenticationError(message)
+        return form
+
+    def _send_form(self, form: Optional[Tag] = None, soup_data: Optional[str] = None, form_data: Optional[dict] = None):
+        if form is None and soup_data is not None:
+            form = self._get_form(soup_data)
+        if form is None:
+            raise AttributeError('No form to send.')
+        if not form_data:
+            form_data = dict()
 
         action_url = form.get('action')
         for field in form.find_all('input'):
@@ -50,8 +75,17 @@ class SENProvider(object):
         response = self._session.post(action_url, data=form_data, allow_redirects=True)
         return response
 
+    def _parse_client_page(self, data):
+        soup = self._get_soup(data)
+        self._client_name = soup.find('h3', id='nomeCliente').text.strip()
+        self._client_id = soup.find('a', id='tabsForniture_selezionata').find('b').text
+        logger.debug(f'Client name is: {self._client_name}')
+        logger.debug(f'Client ID is: {self._client_id}')
+        self._config.write(section='client', values={'name': self._client_name, 'id': self._client_id})
+
     def _real_auth(self, username, password):
-        self._session = requests.Session()
+        # drop the previous login state but keep the session, and with it the connection pool
+        self._session.cookies.clear()
 
         logger.debug('Getting base url...')
         response = self._session.get(self._base_url)
@@ -61,23 +95,97 @@ class SENProvider(object):
             'txtUsername': username,
             'txtPassword': password
         }
-        login_response = self._send_form(soup_data=response.text, form_data=login_data)
+        login_form = self._get_login_step_form(response.text, 'login')
+        login_response = self._send_form(form=login_form, form_data=login_data)
         logger.debug('Got login response')
 
         # saml request
-        response = self._send_form(soup_data=login_response.text)
+        saml_request_form = self._get_login_step_form(login_response.text, 'saml request')
+        if self._is_login_form(saml_request_form):
+            message = 'Authentication error or wrong credentials.'
+            logger.error(message)
+            raise AuthenticationError(message)
+        response = self._send_form(form=saml_request_form)
         logger.debug('Done saml request')
 
         # saml response
-        response = self._send_form(soup_data=response.text)
+        saml_response_form = self._get_login_step_form(response.text, 'saml response')
+        response = self._send_form(form=saml_response_form)
         logger.debug('Got saml response')
 
-        soup = self._get_soup(response.text)
-        self._client_name = soup.find('h3', id='nomeCliente').text.strip()
-        self._client_id = soup.find('a', id='tabsForniture_selezionata').find('b').text
-        logger.debug(f'Client name is: {self._client_name}')
-        logger.debug(f'Client ID is: {self._client_id}')
-        self._config.write(section='client', values={'name': self._client_name, 'id': self._client_id})
+        self._parse_client_page(response.text)
+
+        # the saml values change on every login and must not be stored, those templates only recognize the forms
+        self._forms.put('login', FormTemplate.from_form(login_form))
+        self._forms.put('saml_request', FormTemplate.from_form(saml_request_form, keep_values=False))
+        self._forms.put('saml_response', FormTemplate.from_form(saml_response_form, keep_values=False))
+
+    def _has_sso_cookies(self, login_template: FormTemplate) -> bool:
+        host = urlparse(login_template.action).hostname or ''
+        for cookie in self._session.cookies:
+            domain = cookie.domain.lstrip('.')
+            if (host == domain or host.endswith(f'.{domain}')) and not cookie.is_expired():
+                return True
+        return False
+
+    def _fast_auth(self, username, password) -> bool:
+        """
+        Login using the cached form templates, skipping the hops that are not needed
+        :return: True if authenticated, False if the full login flow is needed
+        :raises AuthenticationError: if the credentials were rejected
+        """
+        login_template = self._forms.get('login')
+        saml_templates = [self._forms.get('saml_request'), self._forms.get('saml_response')]
+        if login_template is None or None in saml_templates:
+            return False
+
+        credentials = {
+            'txtUsername': username,
+            'txtPassword': password
+        }
+        cached_login_sent = False
+        login_form_sent = False
+        if self._has_sso_cookies(login_template):
+            # the identity provider may still know us, in that case the saml forms are enough
+            logger.debug('Found SSO cookies, getting client area...')
+            response = self._session.get(self._client_area_url)
+        else:
+            logger.debug('Sending cached login form...')
+            response = self._session.post(login_template.action, data=dict(login_template.fields, **credentials),
+                                          allow_redirects=True)
+            cached_login_sent = True
+
+        for _ in range(self._max_login_hops):
+            if 'nomeCliente' in response.text:
+                self._parse_client_page(response.text)
+                return True
+
+            form = self._get_form(response.text)
+            if form is None:
+                break
+            if self._is_login_form(form):
+                if cached_login_sent:
+                    # its hidden values may be stale, the full flow sends the credentials once more with fresh ones
+                    logger.debug('Cached login form rejected')
+                    self._forms.invalidate()
+                    return False
+                if login_form_sent:
+                    # rejected by a fresh form, sending them again could lock the account
+                    message = 'Authentication error or wrong credentials.'
+                    logger.error(message)
+                    raise AuthenticationError(message)
+                logger.debug('Sending login form...')
+                response = self._send_form(form=form, form_data=dict(credentials))
+                login_form_sent = True
+            elif any(t.matches(form) for t in saml_templates):
+                logger.debug('Sending saml form...')
+                response = self._send_form(form=form)
+            else:
+                break
+
+        logger.debug('Login flow changed, cached forms are outdated')
+        self._forms.invalidate()
+        return False
 
     @property
     def is_authenticated(self) -> bool:
@@ -99,6 +207,19 @@ class SENProvider(object):
             'name': self._client_name if self._client_name else self._config.get_value('client', 'name')
         }
 
+    @property
+    def username(self) -> Optional[str]:
+        return self._config.get_value('auth', 'username')
+
+    @property
+    def session_age(self) -> Optional[float]:
+        """
+        :return: seconds elapsed since the session was saved, None if there is no saved session
+        """
+        if not os.path.isfile(self._session_path):
+            return None
+        return time.time() - os.path.getmtime(self._session_path)
+
     def save_session(self):
         logger.debug('Saving session...')
         with open(self._session_path, 'wb') as f:
@@ -111,8 +232,11 @@ class SENProvider(object):
         logger.debug('Loading session...')
         if os.path.isfile(self._session_path):
             with open(self._session_path, 'rb') as f:
-                self._session = pickle.load(f)
-                return True
+                session = pickle.load(f)
+            # only take the cookies, replacing the session would discard its connection pool
+            self._session.cookies.clear()
+            self._session.cookies.update(session.cookies)
+            return True
         return False
 
     def authenticate(self, username: Optional[str] = None, password: Optional[str] = None, force=False):
@@ -128,7 +252,9 @@ class SENProvider(object):
             self.load_session()
         if force or not self.is_authenticated:
             try:
-                self._real_auth(username, password)
+                if not self._fast_auth(username, password):
+                    logger.debug('Using full login flow...')
+                    self._real_auth(username, password)
                 self.save_session()
             except AttributeError:
                 message = 'Authentication error or wrong credentials.'
@@ -4,5 +4,9 @@ from datetime import datetime
 def str_to_datetime(str_date) -> datetime:
     return datetime.strptime(str_date, '%d/%m/%Y')
 
+
+def iso_to_str(iso_date) -> str:
+    return datetime.strptime(iso_date, '%Y-%m-%d').strftime('%d/%m/%Y')
+
 ########################################################################################################################
 
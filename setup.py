@@ -17,7 +17,7 @@ setup(
     install_requires=[
         'requests',
         'beautifulsoup4',
-        'click',
+        'click>=8.0',
         'halo',
         'loguru',
         'rich'
@@ -0,0 +1,50 @@
+import tempfile
+
+from bs4 import BeautifulSoup
+
+from sen_api.forms import FormTemplate, FormTemplateCache
+
+
+LOGIN_PAGE = '''
+<html><body>
+<form action="https://login.example.com/login" method="post">
+    <input type="text" name="txtUsername">
+    <input type="password" name="txtPassword">
+    <input type="hidden" name="app" value="ESE_AREA_CLIENTI">
+    <input type="submit" name="btnLogin" value="Accedi">
+</form>
+</body></html>
+'''
+
+
+def _get_form(data):
+    return BeautifulSoup(data, 'html.parser').find('form')
+
+
+def test_form_template():
+    form = _get_form(LOGIN_PAGE)
+    template = FormTemplate.from_form(form)
+    assert template.action == 'https://login.example.com/login'
+    assert template.fields == {'app': 'ESE_AREA_CLIENTI', 'btnLogin': 'Accedi'}
+    assert template.matches(form)
+
+    changed_form = _get_form(LOGIN_PAGE.replace('name="app"', 'name="token"'))
+    assert not template.matches(changed_form)
+
+    assert FormTemplate.from_dict(template.to_dict()).to_dict() == template.to_dict()
+
+
+def test_form_template_cache():
+    with tempfile.TemporaryDirectory() as base_path:
+        cache = FormTemplateCache(base_path=base_path)
+        assert cache.get('login') is None
+
+        template = FormTemplate.from_form(_get_form(LOGIN_PAGE))
+        cache.put('login', template)
+        assert cache.get('login').to_dict() == template.to_dict()
+
+        expired_cache = FormTemplateCache(base_path=base_path, max_age=-1)
+        assert expired_cache.get('login') is None
+
+        cache.invalidate()
+        assert cache.get('login') is None
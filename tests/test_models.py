@@ -1,4 +1,4 @@
-from sen_api import IntervalReading
+from sen_api import IntervalReading, Bill
 
 
 def test_interval_reading():
@@ -11,3 +11,13 @@ def test_interval_reading():
     assert reading.avg_consumption == 11
 
     assert IntervalReading('01/03/2020', '31/03/2020', 341) == reading
+
+
+def test_models_from_dict():
+    reading = IntervalReading('01/10/2020', '04/10/2020', 55)
+    assert IntervalReading.from_dict(reading.to_dict()).to_dict() == reading.to_dict()
+
+    bill = Bill(1, '15/03/2020', 52.3, True, False, params={'codFatt_1': '123'})
+    restored = Bill.from_dict(bill.to_dict())
+    assert restored.to_dict() == bill.to_dict()
+    assert restored.params == dict()
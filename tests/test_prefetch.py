@@ -0,0 +1,178 @@
+import time
+import tempfile
+
+import pytest
+
+from sen_api.prefetch import PrefetchStore, PrefetchScheduler
+
+
+def test_prefetch_store():
+    with tempfile.TemporaryDirectory() as base_path:
+        store = PrefetchStore(base_path=base_path)
+        assert store.get('user', 'last_reading') is None
+        assert store.freshness('user') == {}
+
+        data = {'reading_date': '01/10/2020', 'readings': {'A1': '1', 'A2': '2', 'A3': '3'}}
+        store.put('user', 'last_reading', data)
+        store.put('user', 'bills_years', ['2020', '2019'])
+
+        assert store.get('user', 'last_reading') == data
+        assert store.get('user', 'last_reading', max_age=60) == data
+        assert store.get('other_user', 'last_reading') is None
+        assert set(store.freshness('user').keys()) == {'last_reading', 'bills_years'}
+
+        time.sleep(0.01)
+        assert store.get('user', 'bills_years', max_age=0) is None
+
+
+class FakeProvider(object):
+    def __init__(self, username, session_age=None, is_authenticated=True):
+        self.username = username
+        self.session_age = session_age
+        self.is_authenticated = is_authenticated
+        self.logins = 0
+        self.saves = 0
+        self.parse_errors = 0
+
+    def authenticate(self, force=False):
+        self.logins += 1
+        self.session_age = 0
+
+    def load_session(self):
+        return self.session_age is not None
+
+    def save_session(self):
+        self.saves += 1
+        self.session_age = 0
+
+    def get_last_reading(self):
+        if self.parse_errors > 0:
+            self.parse_errors -= 1
+            raise AttributeError
+        return {'reading_date': '01/10/2020'}
+
+    def get_all_readings(self):
+        return []
+
+    def get_bills_available_years(self):
+        return []
+
+
+def _scheduler(providers, base_path, **kwargs):
+    kwargs.setdefault('min_spacing', 0)
+    return PrefetchScheduler(providers, PrefetchStore(base_path=base_path), **kwargs)
+
+
+def test_prefetch_scheduler_schedule():
+    with tempfile.TemporaryDirectory() as base_path:
+        providers = [FakeProvider('a'), FakeProvider('b', session_age=0)]
+        scheduler = _scheduler(providers, base_path, interval=10, session_ttl=100)
+
+        # accounts are staggered over the interval
+        assert scheduler._next_prefetch[1] - scheduler._next_prefetch[0] == pytest.approx(5)
+
+        # no session means refresh now, otherwise at 80% of its lifetime
+        assert scheduler._next_session_refresh[0] == pytest.approx(time.time(), abs=1)
+        assert scheduler._next_session_refresh[1] == pytest.approx(time.time() + 80, abs=1)
+
+        for _ in range(100):
+            assert 9 <= scheduler._jittered(10) <= 11
+
+        with pytest.raises(ValueError):
+            _scheduler(providers, base_path, interval=0)
+        with pytest.raises(ValueError):
+            _scheduler(providers, base_path, session_ttl=-1)
+
+
+def test_prefetch_scheduler_pace():
+    with tempfile.TemporaryDirectory() as base_path:
+        scheduler = _scheduler([FakeProvider('a')], base_path, min_spacing=0.05)
+        start = time.time()
+        for _ in range(3):
+            scheduler._pace()
+        assert time.time() - start >= 0.1
+
+
+def test_prefetch_scheduler_session_refresh():
+    with tempfile.TemporaryDirectory() as base_path:
+        # still valid on the portal: kept alive without logging in
+        provider = FakeProvider('a', session_age=1000)
+        scheduler = _scheduler([provider], base_path, session_ttl=100)
+        assert scheduler._refresh_session(0)
+        assert provider.logins == 0 and provider.saves == 1
+        assert scheduler._next_session_refresh[0] > time.time()
+
+        # not due yet: nothing to do
+        assert scheduler._refresh_session(0)
+        assert provider.logins == 0 and provider.saves == 1
+
+        # dropped by the portal: logged in again
+        provider = FakeProvider('a', session_age=1000, is_authenticated=False)
+        scheduler = _scheduler([provider], base_path, session_ttl=100)
+        assert scheduler._refresh_session(0)
+        assert provider.logins == 1
+
+
+def test_prefetch_scheduler_fetch_retry():
+    with tempfile.TemporaryDirectory() as base_path:
+        provider = FakeProvider('a', session_age=0)
+        provider.parse_errors = 1
+        scheduler = _scheduler([provider], base_path)
+        scheduler.run_once()
+        assert provider.logins == 1
+        assert scheduler._store.get('a', 'last_reading') == {'reading_date': '01/10/2020'}
+
+        # a page that cannot be parsed even after logging in again is skipped
+        provider.parse_errors = 2
+        scheduler._store.put('a', 'last_reading', 'previous')
+        scheduler.run_once()
+        assert provider.logins == 2
+        assert scheduler._store.get('a', 'last_reading') == 'previous'
+
+
+def test_prefetch_scheduler_start_stop():
+    with tempfile.TemporaryDirectory() as base_path:
+        scheduler = _scheduler([FakeProvider('a', session_age=0)], base_path, interval=60)
+        scheduler.start()
+        for _ in range(100):
+            if scheduler._store.get('a', 'all_readings') is not None:
+                break
+            time.sleep(0.01)
+        scheduler.stop(timeout=1)
+        assert scheduler._thread is None
+        assert scheduler._store.get('a', 'all_readings') == []
+
+
+class BrokenProvider(FakeProvider):
+    def authenticate(self, force=False):
+        self.logins += 1
+        raise KeyError('session')
+
+    def get_all_readings(self):
+        raise RuntimeError('unexpected')
+
+
+def test_prefetch_scheduler_unexpected_errors():
+    with tempfile.TemporaryDirectory() as base_path:
+        # an unexpected error skips the rest of the account data, without stopping the scheduler
+        provider = BrokenProvider('a', session_age=0)
+        scheduler = _scheduler([provider, FakeProvider('b', session_age=0)], base_path, interval=60)
+        scheduler.run_once()
+        assert scheduler._store.get('a', 'last_reading') is not None
+        assert scheduler._store.get('a', 'bills_years') is None
+        assert scheduler._store.get('b', 'bills_years') == []
+
+        # a failing session refresh is scheduled again instead of killing the thread
+        provider = BrokenProvider('a', is_authenticated=False)
+        scheduler = _scheduler([provider], base_path, interval=60)
+        scheduler._next_prefetch[0] = time.time() + 60
+        scheduler.start()
+        for _ in range(100):
+            if provider.logins > 0:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert scheduler._thread.is_alive()
+        assert provider.logins == 1
+        assert scheduler._next_session_refresh[0] > time.time()
+        scheduler.stop(timeout=1)
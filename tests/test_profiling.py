@@ -0,0 +1,77 @@
+import os
+import time
+import tempfile
+import threading
+
+import pytest
+
+from sen_api import IntervalReading
+from sen_api.profiling import Profiler
+from sen_api.cli import cli
+
+
+@pytest.mark.parametrize('mode', ['cpu', 'mem'])
+def test_profiler(mode):
+    with tempfile.TemporaryDirectory() as output_dir:
+        with Profiler(mode=mode, output_dir=output_dir, name='test') as profiler:
+            readings = [IntervalReading('01/10/2020', '04/10/2020', i) for i in range(1000)]
+        assert len(readings) == 1000
+
+        assert os.path.basename(profiler.report_path).startswith(f'test-{mode}-')
+        with open(profiler.report_path, 'r') as f:
+            assert f.readline().startswith('wall time:')
+        assert os.path.isfile(profiler.collapsed_path)
+
+
+def test_profiler_wrong_mode():
+    with pytest.raises(ValueError):
+        Profiler(mode='gpu')
+
+
+def test_profiler_unique_paths():
+    with tempfile.TemporaryDirectory() as output_dir:
+        paths = set()
+        for _ in range(2):
+            with Profiler(mode='cpu', output_dir=output_dir, name='test') as profiler:
+                pass
+            paths.add(profiler.report_path)
+        assert len(paths) == 2
+
+
+@pytest.mark.parametrize('args, profile', [
+    (['--profile', 'client-info'], 'cpu'),
+    (['--profile', 'mem', 'client-info'], 'mem'),
+    (['--profile=mem', 'client-info'], 'mem'),
+    (['client-info'], None),
+])
+def test_profile_option(args, profile):
+    ctx = cli.make_context('sen-api', args)
+    assert ctx.params['profile'] == profile
+
+
+def test_profile_option_command_args():
+    # "--profile" given as the value of a command option must not be rewritten
+    ctx = cli.make_context('sen-api', ['authenticate', '-u', 'user', '-p', '--profile'])
+    assert ctx.params['profile'] is None
+    assert ctx.args[-1] == '--profile'
+
+
+def _busy_thread_work(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+
+def test_profiler_other_threads():
+    with tempfile.TemporaryDirectory() as output_dir:
+        stop_event = threading.Event()
+        thread = threading.Thread(target=_busy_thread_work, args=(stop_event,), name='spinner')
+        with Profiler(mode='cpu', output_dir=output_dir, interval=0.001) as profiler:
+            thread.start()
+            time.sleep(0.1)
+            stop_event.set()
+            thread.join()
+
+        with open(profiler.collapsed_path, 'r') as f:
+            stacks = f.read().splitlines()
+        assert any(s.startswith('spinner;') and '_busy_thread_work' in s for s in stacks)
+        assert any(s.startswith('MainThread;') for s in stacks)
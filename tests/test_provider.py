@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import pickle
+import tempfile
+
+import pytest
+import requests
+from requests.cookies import RequestsCookieJar, create_cookie
+
+from sen_api import SENProvider, Config, AuthenticationError, FormTemplate
+
+
+IDP_URL = 'https://idp.example.com'
+BASE_URL = SENProvider._base_url
+CLIENT_AREA_URL = SENProvider._client_area_url
+
+LOGIN_PAGE = f'''<form action="{IDP_URL}/login"><input name="txtUsername">
+<input type="password" name="txtPassword"><input type="hidden" name="app" value="{{token}}"></form>'''
+SAML_REQUEST_PAGE = f'<form action="{IDP_URL}/saml"><input type="hidden" name="SAMLRequest" value="REQUEST"></form>'
+SAML_RESPONSE_PAGE = f'<form action="{BASE_URL}/acs"><input type="hidden" name="SAMLResponse" value="ASSERTION"></form>'
+CLIENT_PAGE = '<h3 id="nomeCliente"> Mario Rossi </h3><a id="tabsForniture_selezionata"><b>123456</b></a>'
+
+
+class FakeResponse(object):
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+
+class FakeSession(object):
+    """
+    Portal and identity provider: the SSO cookie makes the client area start from the saml response.
+    With rotate_token the hidden login value changes on every page load, like a CSRF token
+    """
+    def __init__(self, password='password', saml_response_page=SAML_RESPONSE_PAGE, rotate_token=False):
+        self.cookies = RequestsCookieJar()
+        self.password = password
+        self.saml_response_page = saml_response_page
+        self.rotate_token = rotate_token
+        self.base_page = None
+        self.token = 'ESE_AREA_CLIENTI'
+        self.token_count = 0
+        self.requests = []
+
+    def _login_page(self):
+        if self.rotate_token:
+            self.token_count += 1
+            self.token = f'token{self.token_count}'
+        return LOGIN_PAGE.format(token=self.token)
+
+    @property
+    def credential_posts(self) -> int:
+        return len([r for r in self.requests if r[2] and 'txtPassword' in r[2]])
+
+    def _page(self, url, data):
+        if url == BASE_URL:
+            return self.base_page if self.base_page is not None else self._login_page()
+        if url == f'{IDP_URL}/login':
+            if data.get('txtPassword') != self.password or data.get('app') != self.token:
+                return self._login_page()
+            self.cookies.set('sso', '1', domain='.example.com')
+            return SAML_REQUEST_PAGE
+        if url == f'{IDP_URL}/saml':
+            return self.saml_response_page
+        if url == f'{BASE_URL}/acs':
+            return CLIENT_PAGE
+        if url == CLIENT_AREA_URL:
+            return self.saml_response_page if 'sso' in self.cookies else self._login_page()
+        return ''
+
+    def get(self, url, **kwargs):
+        self.requests.append(('GET', url, None))
+        return FakeResponse(url, self._page(url, dict()))
+
+    def post(self, url, data=None, **kwargs):
+        self.requests.append(('POST', url, data))
+        return FakeResponse(url, self._page(url, data or dict()))
+
+
+@pytest.fixture
+def provider():
+    with tempfile.TemporaryDirectory() as base_path:
+        provider = SENProvider(config=Config(base_path=base_path))
+        provider._session = FakeSession()
+        yield provider
+
+
+def _login(provider):
+    provider._real_auth('user', 'password')
+    provider._session.cookies.clear()
+    provider._session.requests.clear()
+
+
+def test_real_auth_saves_templates(provider):
+    provider._real_auth('user', 'password')
+    assert provider.client_info == {'id': '123456', 'name': 'Mario Rossi'}
+
+    with open(os.path.join(provider._config.base_path, 'forms.json'), 'r') as f:
+        data = f.read()
+    # saml values are secrets, only the input names are stored
+    assert 'ASSERTION' not in data and 'REQUEST' not in data
+    assert json.loads(data)['saml_response']['template']['fields'] == {'SAMLResponse': None}
+    assert provider._forms.get('login').fields == {'app': 'ESE_AREA_CLIENTI'}
+
+
+def test_fast_auth_without_templates(provider):
+    assert not provider._fast_auth('user', 'password')
+    assert provider._session.requests == []
+
+
+def test_fast_auth_cached_login_form(provider):
+    _login(provider)
+    assert provider._fast_auth('user', 'password')
+    assert [r[1] for r in provider._session.requests] == [f'{IDP_URL}/login', f'{IDP_URL}/saml', f'{BASE_URL}/acs']
+    assert provider._session.credential_posts == 1
+
+
+def test_fast_auth_sso_cookies(provider):
+    _login(provider)
+    provider._session.cookies.set('sso', '1', domain='.example.com')
+    assert provider._fast_auth('user', 'password')
+    assert [r[1] for r in provider._session.requests] == [CLIENT_AREA_URL, f'{BASE_URL}/acs']
+    assert provider._session.credential_posts == 0
+
+
+def test_fast_auth_wrong_credentials(provider):
+    _login(provider)
+    with pytest.raises(AuthenticationError):
+        provider.authenticate('user', 'wrong', force=True)
+    # rejected cached form, then rejected fresh form of the full flow, never more
+    assert provider._session.credential_posts == 2
+    assert provider._forms.get('login') is None
+
+
+def test_fast_auth_wrong_credentials_fresh_form(provider):
+    _login(provider)
+    # SSO cookie the identity provider does not accept anymore: it sends a fresh login form
+    provider._session.cookies.set('expired_sso', '1', domain='.example.com')
+    with pytest.raises(AuthenticationError):
+        provider._fast_auth('user', 'wrong')
+    assert provider._session.credential_posts == 1
+
+
+def test_fast_auth_stale_hidden_value():
+    with tempfile.TemporaryDirectory() as base_path:
+        provider = SENProvider(config=Config(base_path=base_path))
+        provider._session = FakeSession(rotate_token=True)
+        _login(provider)
+        provider._session._login_page()
+
+        # the cached token is stale, the full flow logs in with a fresh one
+        provider.authenticate('user', 'password', force=True)
+        assert provider.client_info['id'] == '123456'
+        assert provider._session.credential_posts == 2
+
+
+def test_real_auth_page_without_form(provider):
+    provider._session.base_page = '<html><body>Servizio in manutenzione</body></html>'
+    with pytest.raises(AuthenticationError):
+        provider.authenticate('user', 'password', force=True)
+    assert provider._session.credential_posts == 0
+
+
+def test_fast_auth_flow_changed(provider):
+    _login(provider)
+    provider._session.saml_response_page = SAML_RESPONSE_PAGE.replace('/acs', '/new-acs')
+    assert not provider._fast_auth('user', 'password')
+    assert provider._forms.get('saml_response') is None
+
+
+def test_has_sso_cookies(provider):
+    template = FormTemplate(action=f'{IDP_URL}/login', fields=dict())
+    cookies = provider._session.cookies
+    assert not provider._has_sso_cookies(template)
+
+    cookies.set('other', '1', domain='xample.com')
+    assert not provider._has_sso_cookies(template)
+
+    cookies.set_cookie(create_cookie('expired', '1', domain='.example.com', expires=int(time.time()) - 10))
+    assert not provider._has_sso_cookies(template)
+
+    cookies.set('sso', '1', domain='.example.com')
+    assert provider._has_sso_cookies(template)
+
+
+def test_form_template_cache_entry_without_time(provider):
+    with open(provider._forms.path, 'w') as f:
+        json.dump({'login': {'template': {'action': f'{IDP_URL}/login', 'fields': {}}}}, f)
+    assert provider._forms.get('login') is None
+
+
+def test_load_session_keeps_session():
+    with tempfile.TemporaryDirectory() as base_path:
+        provider = SENProvider(config=Config(base_path=base_path))
+        saved_session = requests.Session()
+        saved_session.cookies.set('JSESSIONID', 'abc', domain='example.com')
+        with open(provider._session_path, 'wb') as f:
+            pickle.dump(saved_session, f)
+
+        session = provider._session
+        provider._session.cookies.set('old', '1', domain='example.com')
+        assert provider.load_session()
+        assert provider._session is session
+        assert provider._session.cookies.get('JSESSIONID') == 'abc'
+        assert provider._session.cookies.get('old') is None